@@ -6,18 +6,12 @@ setup(
     packages=find_packages(where="src"),
     package_dir={"": "src"},
     install_requires=[
-        "pandas==2.2.3",
-        "numpy==2.2.4",
-        "pyarrow==19.0.0",
-        "python-dateutil==2.9.0.post0",
-        "pytz==2024.1",
-        "requests==2.32.3",
-        "tqdm==4.67.1",
-        "urllib3==2.3.0",
-        "certifi==2025.1.31",
-        "charset-normalizer==3.4.1",
-        "idna==3.10",
-        "six==1.17.0"
+        "numpy>=2.2.4,<3",
+        "pyarrow>=19.0.0",
+        "httpx[http2]>=0.27",
+        "parfive>=2.1.0",
+        "isal>=1.6",
+        "tqdm>=4.67.1"
     ],
     entry_points={
         "console_scripts": [
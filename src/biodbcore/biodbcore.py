@@ -79,6 +79,12 @@ def parse_args():
         default=1,
         help="Max results to retrieve (default: 1)",
     )
+    parser.add_argument(
+        "--max_conn",
+        type=int,
+        default=5,
+        help="Maximum number of parallel FASTQ downloads (default: 5)",
+    )
     parser.add_argument(
         "--assembly_quality",
         default=None,
@@ -86,6 +92,18 @@ def parse_args():
         help="Assembly quality filter (optional)",
     )
 
+    # Arguments for the metadata cache
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Do not use the metadata cache in ~/.cache/biodbcore",
+    )
+    parser.add_argument(
+        "--refresh_cache",
+        action="store_true",
+        help="Refetch RefSeq/ENA metadata and overwrite the cached copies",
+    )
+
     return parser.parse_args()
 
 
@@ -1,6 +1,4 @@
 from .constants import ENA_READ_RUN_URL, ENA_QUERY_FIELDS
-from .refseq_retriver import RefSeqRetriver
-from .ena_searcher import ENASearcher
 from .pipeline import Pipeline
 
 __all__ = [
@@ -10,3 +8,17 @@ __all__ = [
     "ENASearcher",
     "Pipeline",
 ]
+
+
+def __getattr__(name):
+    # The retrievers are imported on first access, so a pipeline running
+    # a single mode never imports the other one and its dependencies
+    if name == "RefSeqRetriver":
+        from .refseq_retriver import RefSeqRetriver
+
+        return RefSeqRetriver
+    if name == "ENASearcher":
+        from .ena_searcher import ENASearcher
+
+        return ENASearcher
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
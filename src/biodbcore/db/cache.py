@@ -0,0 +1,69 @@
+import os
+import json
+import time
+import hashlib
+import functools
+
+# Cache shared by all runs, so repeated invocations skip the ENA/RefSeq round-trips
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "biodbcore"
+)
+DEFAULT_CACHE_TTL = 7 * 86400  # one week, in seconds
+
+
+def cache_key(url: str, params: dict = None) -> str:
+    """
+    Returns a stable hash identifying a request to 'url' with query 'params'.
+    """
+    payload = json.dumps([url, params or {}], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def is_fresh(path: str, ttl: int = DEFAULT_CACHE_TTL) -> bool:
+    """
+    Checks whether the file at 'path' exists and is younger than 'ttl' seconds.
+    """
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl
+
+
+def disk_cached(ttl: int = DEFAULT_CACHE_TTL):
+    """
+    Decorator caching the JSON result of a method called as method(url, params) on disk.
+
+    The instance provides 'cache_dir' (None disables the cache) and
+    'refresh_cache' (True ignores cached entries and overwrites them).
+    Results are stored as JSON under 'cache_dir', keyed by the URL and its parameters.
+    Unreadable entries are fetched again and a cache that cannot be written is skipped.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, url: str, params: dict = None):
+            if not self.cache_dir:
+                return func(self, url, params)
+
+            path = os.path.join(self.cache_dir, f"{cache_key(url, params)}.json")
+            if not self.refresh_cache and is_fresh(path, ttl):
+                try:
+                    with open(path) as f:
+                        return json.load(f)
+                except (OSError, ValueError):
+                    pass
+
+            result = func(self, url, params)
+
+            # Write to a temporary file first so concurrent runs never read a partial entry
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(tmp_path, "w") as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                # The cache is only an optimization, e.g. the home directory may be read-only
+                print(f"Could not write cache entry {path}: {e}")
+            return result
+
+        return wrapper
+
+    return decorator
@@ -57,6 +57,8 @@ SUPPORTED_INSTRUMENT_PLATFORM = [
 NCBI_REFSEQ_URL = "https://ftp.ncbi.nlm.nih.gov/genomes/refseq/"
 ENA_READ_RUN_URL = "https://www.ebi.ac.uk/ena/portal/api/search"
 ENA_QUERY_FIELDS = "run_accession,library_strategy,base_count,first_public"
+# Maximum number of ENA records fetched and ranked per taxon
+ENA_RESULTS_PER_TAXON = 10000
 REFSEQ_ASSEMBLY_SUMMARY_URL = (
     "https://ftp.ncbi.nlm.nih.gov/genomes/refseq/assembly_summary_refseq.txt"
 )
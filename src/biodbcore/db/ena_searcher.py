@@ -1,9 +1,17 @@
 import os
-import requests
+import json
+import functools
+import httpx
+from parfive import Downloader
 from tqdm import tqdm
 from urllib.parse import urlsplit
 
-from .constants import ENA_READ_RUN_URL
+from .cache import disk_cached
+from .constants import ENA_READ_RUN_URL, ENA_RESULTS_PER_TAXON
+from .http_client import get_client
+
+# Manifest of completed FASTQ downloads, kept in the download directory
+DOWNLOAD_MANIFEST_NAME = ".biodbcore_manifest.json"
 
 
 class ENASearcher:
@@ -22,15 +30,38 @@ class ENASearcher:
         max_coverage: int = None,
         assembly_quality=None,
         sort=False,
+        max_conn: int = 5,
+        cache_dir: str = None,
+        refresh_cache: bool = False,
+        client: httpx.Client = None,
     ):
         self.taxonomy_id = taxonomy_id
-        self.library_strategy = library_strategy
-        self.instrument_platform = instrument_platform
+        # Normalized to lowercase tuples, so callers may pass any iterable
+        self.library_strategy = tuple(map(str.lower, library_strategy or ()))
+        self.instrument_platform = tuple(map(str.lower, instrument_platform or ()))
         self.max_results = max_results
         self.min_coverage = min_coverage
         self.max_coverage = max_coverage
         self.assembly_quality = assembly_quality
         self.sort = sort
+        self.max_conn = max_conn
+        self.cache_dir = cache_dir
+        self.refresh_cache = refresh_cache
+        self.client = client or get_client()
+
+    @functools.cached_property
+    def _library_strategy_query(self) -> str:
+        """Query part matching any of the library strategies (empty if none given)."""
+        return " OR ".join(
+            f'library_strategy="{stype}"' for stype in self.library_strategy
+        )
+
+    @functools.cached_property
+    def _instrument_platform_query(self) -> str:
+        """Query part matching any of the instrument platforms (empty if none given)."""
+        return " OR ".join(
+            f'instrument_platform="{platform}"' for platform in self.instrument_platform
+        )
 
     def search_sequence_data(self, genome_size_ungapped: int = None) -> list:
         """
@@ -40,32 +71,52 @@ class ENASearcher:
         Returns:
         - list: Sorted list of results (dicts), limited to max_results.
         """
-        query_parts = [f"tax_eq({self.taxonomy_id})"]
+        return self.search_sequence_data_by_taxon(
+            {self.taxonomy_id: genome_size_ungapped}
+        )[self.taxonomy_id]
+
+    def search_sequence_data_by_taxon(
+        self, genome_sizes_ungapped: dict[int, int]
+    ) -> dict[int, list]:
+        """
+        Query the ENA database for sequencing runs of several taxa with a single request.
+        The coverage filter of each taxon uses its own ungapped genome size.
+
+        Every taxon has a budget of ENA_RESULTS_PER_TAXON records: the request is limited
+        to the budget times the number of taxa, and each taxon ranks at most its budget.
+        A single taxon is thus ranked on the same records whether queried alone or batched,
+        unless several taxa of the batch exceed their budget and share the limit.
 
-        if self.library_strategy and self.library_strategy != []:
-            query_parts.append(
-                " OR ".join(
-                    f'library_strategy="{stype}"' for stype in self.library_strategy
+        Parameters:
+        - genome_sizes_ungapped (dict[int, int]): taxonomy ID -> ungapped genome size (or None).
+
+        Returns:
+        - dict[int, list]: taxonomy ID -> sorted list of results (dicts), limited to max_results.
+        """
+        # One clause per taxon, OR-ed together, as the coverage bounds differ between taxa
+        taxon_clauses = []
+        for taxonomy_id, genome_size_ungapped in genome_sizes_ungapped.items():
+            taxon_parts = [f"tax_eq({taxonomy_id})"]
+
+            if self.min_coverage is not None and genome_size_ungapped is not None:
+                taxon_parts.append(
+                    f"base_count>={genome_size_ungapped * self.min_coverage}"
                 )
-            )
 
-        if self.instrument_platform and self.instrument_platform != []:
-            query_parts.append(
-                " OR ".join(
-                    f'instrument_platform="{platform}"'
-                    for platform in self.instrument_platform
+            if self.max_coverage is not None and genome_size_ungapped is not None:
+                taxon_parts.append(
+                    f"base_count<={genome_size_ungapped * self.max_coverage}"
                 )
-            )
 
-        if self.min_coverage is not None and genome_size_ungapped is not None:
-            query_parts.append(
-                f"base_count>={genome_size_ungapped * self.min_coverage}"
-            )
+            taxon_clauses.append(" AND ".join(taxon_parts))
 
-        if self.max_coverage is not None and genome_size_ungapped is not None:
-            query_parts.append(
-                f"base_count<={genome_size_ungapped * self.max_coverage}"
-            )
+        if len(taxon_clauses) == 1:
+            query_parts = taxon_clauses
+        else:
+            query_parts = [" OR ".join(f"({clause})" for clause in taxon_clauses)]
+
+        query_parts.append(self._library_strategy_query)
+        query_parts.append(self._instrument_platform_query)
 
         if self.assembly_quality and not self.assembly_quality == "":
             query_parts.append(f"assembly_quality={self.assembly_quality}")
@@ -76,24 +127,34 @@ class ENASearcher:
         params = {
             "result": "read_run",
             "query": query,
-            "fields": "run_accession,library_strategy,instrument_platform,base_count,"
+            "fields": "run_accession,tax_id,library_strategy,instrument_platform,base_count,"
             "read_count,description,last_updated,fastq_ftp,assembly_quality",
             "format": "json",
-            "limit": 10000,
+            "limit": ENA_RESULTS_PER_TAXON * len(genome_sizes_ungapped),
         }
 
         print(f"Sending query to ENA: {params['query']}")
-        response = requests.get(ENA_READ_RUN_URL, params=params)
+        results = self._query_ena(ENA_READ_RUN_URL, params)
 
-        try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            print(f"HTTPError: {e}")
-            print(f"Response Content: {response.text}")
-            raise
+        # Partition the records by taxon
+        results_by_taxon = {taxonomy_id: [] for taxonomy_id in genome_sizes_ungapped}
+        for record in results:
+            taxon_results = results_by_taxon.get(int(record.get("tax_id") or 0))
+            if taxon_results is not None and len(taxon_results) < ENA_RESULTS_PER_TAXON:
+                taxon_results.append(record)
 
-        results = response.json()
+        return {
+            taxonomy_id: self._rank_results(
+                results_by_taxon[taxonomy_id], genome_sizes_ungapped[taxonomy_id]
+            )
+            for taxonomy_id in genome_sizes_ungapped
+        }
 
+    def _rank_results(self, results: list, genome_size_ungapped: int = None) -> list:
+        """
+        Annotate the records of one taxon with their coverage, sort them if requested
+        and keep the first max_results.
+        """
         # Calculate coverage if genome_size is known
         for record in results:
             base_count = int(record.get("base_count", 0))
@@ -127,12 +188,33 @@ class ENASearcher:
 
         return sorted_results[: self.max_results]
 
+    @disk_cached()
+    def _query_ena(self, url: str, params: dict = None) -> list:
+        """
+        Send a query to the ENA portal API and return the decoded JSON records.
+        """
+        response = self.client.get(url, params=params)
+
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            print(f"HTTPError: {e}")
+            print(f"Response Content: {response.text}")
+            raise
+
+        return response.json()
+
     def fetch_fastq_files(
         self, sequence_data: list, outdir: str = "data", max_files: int = None
     ) -> dict[str, list[str]]:
         """
         Download FASTQ files from the URLs provided in the sequence data, placing each run's files
-        in a subfolder named after its run accession.
+        in a subfolder named after its run accession. Files are downloaded concurrently,
+        using up to 'max_conn' connections.
+
+        Files already downloaded completely are skipped and partially downloaded files are
+        resumed. Completed downloads are recorded in a manifest in 'outdir', so later runs
+        can skip them without contacting the server.
 
         Parameters:
         - sequence_data (list): List of dicts with run metadata (including 'fastq_ftp').
@@ -142,79 +224,178 @@ class ENASearcher:
         Returns:
         - dict[str, list[str]]: run_accession -> list of downloaded file paths
         """
-        import requests
-        from tqdm import tqdm
-        from urllib.parse import urlsplit
-
         os.makedirs(outdir, exist_ok=True)
-        downloaded_count = 0
+        queued_count = 0
+        manifest = self._load_manifest(outdir)
 
         # This dict will store run_accession -> [list_of_downloaded_file_paths]
         run_to_files = {}
+        # file_path -> (url, run_accession) for every file handed to the downloader
+        queued_files = {}
+        # (url, file_path, run_accession, offset) for every partially downloaded file
+        partial_files = []
+
+        # One connection per file, so each file is written sequentially and an interrupted
+        # download always leaves a contiguous prefix that can be resumed; split downloads
+        # write at seeked offsets and may leave a full-length file with holes
+        downloader = Downloader(max_conn=self.max_conn, max_splits=1)
+
+        for record in sequence_data:
+            if max_files is not None and queued_count >= max_files:
+                print("Download limit reached. Skipping remaining records.")
+                break
+
+            fastq_ftp = record.get("fastq_ftp", None)
+            run_accession = record.get("run_accession", "N/A")
+            run_to_files[run_accession] = []
+
+            if not fastq_ftp:
+                print(f"No FASTQ URL found for record: {run_accession}")
+                continue
+
+            # Create a subdirectory for this run
+            run_dir = os.path.join(outdir, run_accession)
+            os.makedirs(run_dir, exist_ok=True)
+
+            # Split the FTP string into individual FASTQ URLs
+            for url in fastq_ftp.split(";"):
+                if max_files is not None and queued_count >= max_files:
+                    break
+
+                filename = os.path.basename(urlsplit(url).path)
+                file_path = os.path.join(run_dir, filename)
+                # ENA provides FTP; use http:// for direct GET
+                http_url = f"http://{url}"
+                local_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+                # Files recorded as complete in the manifest are skipped without a request
+                if local_size and manifest.get(http_url, {}).get("size") == local_size:
+                    print(f"File already downloaded: {file_path}. Skipping download.")
+                    run_to_files[run_accession].append(file_path)
+                    continue
 
-        with tqdm(total=len(sequence_data), desc="Downloading FASTQ records", unit="rec") as progress_bar:
-            for record in sequence_data:
-                fastq_ftp = record.get("fastq_ftp", None)
-                run_accession = record.get("run_accession", "N/A")
-
-                # Prepare a list to store all file paths for this run
-                record_files = []
+                # Only existing files need the remote size, to tell complete from partial ones
+                remote_size = self._remote_file_size(http_url) if local_size else None
 
-                if not fastq_ftp:
-                    print(f"No FASTQ URL found for record: {run_accession}")
-                    run_to_files[run_accession] = record_files
-                    progress_bar.update(1)
+                # If the file already exists and is complete (or cannot be checked), skip it
+                if local_size and remote_size in (None, local_size):
+                    print(f"File already exists: {file_path}. Skipping download.")
+                    if remote_size is not None:
+                        manifest[http_url] = {"size": local_size}
+                    run_to_files[run_accession].append(file_path)
                     continue
 
-                # Split the FTP string into individual FASTQ URLs
-                fastq_urls = fastq_ftp.split(";")
-
-                # Create a subdirectory for this run
-                run_dir = os.path.join(outdir, run_accession)
-                os.makedirs(run_dir, exist_ok=True)
-
-                for url in fastq_urls:
-                    if max_files is not None and downloaded_count >= max_files:
-                        print("Download limit reached. Stopping.")
-                        return run_to_files
-
-                    filename = os.path.basename(urlsplit(url).path)
-                    file_path = os.path.join(run_dir, filename)
-
-                    # If the file already exists, skip it
-                    if os.path.exists(file_path):
-                        print(f"File already exists: {file_path}. Skipping download.")
-                        record_files.append(file_path)
-                        continue
-
-                    # Perform the download (ENA provides FTP; use http:// for direct GET)
-                    print(f"Downloading {filename} from {url}...")
-                    try:
-                        response = requests.get(f"http://{url}", stream=True)
-                        response.raise_for_status()
-
-                        total_size = int(response.headers.get("content-length", 0))
-                        with open(file_path, "wb") as f, tqdm(
-                            desc=f"Downloading {filename}",
-                            total=total_size,
-                            unit="B",
-                            unit_scale=True,
-                            unit_divisor=1024,
-                            leave=False
-                        ) as file_bar:
-                            for chunk in response.iter_content(chunk_size=1024):
-                                f.write(chunk)
-                                file_bar.update(len(chunk))
-
-                        print(f"Downloaded {filename} to {file_path}")
-                        record_files.append(file_path)
-                        downloaded_count += 1
-
-                    except requests.exceptions.RequestException as e:
-                        print(f"Failed to download {filename} from {url}: {e}")
-
-                # Store the file paths for this run
-                run_to_files[run_accession] = record_files
-                progress_bar.update(1)
+                if local_size and local_size < remote_size:
+                    partial_files.append((http_url, file_path, run_accession, local_size))
+                else:
+                    downloader.enqueue_file(
+                        http_url, path=run_dir, filename=filename, overwrite=True
+                    )
+                    queued_files[file_path] = (http_url, run_accession)
+                queued_count += 1
+
+        if queued_files:
+            print(f"Downloading {len(queued_files)} FASTQ files...")
+            results = downloader.download()
+
+            downloaded = {os.path.abspath(path) for path in results}
+            for file_path, (http_url, run_accession) in queued_files.items():
+                if os.path.abspath(file_path) in downloaded:
+                    manifest[http_url] = {"size": os.path.getsize(file_path)}
+                    run_to_files[run_accession].append(file_path)
+
+            if results.errors:
+                self._save_failed_downloads(results.errors, outdir)
+
+        for http_url, file_path, run_accession, offset in partial_files:
+            if self._resume_download(http_url, file_path, offset):
+                manifest[http_url] = {"size": os.path.getsize(file_path)}
+                run_to_files[run_accession].append(file_path)
+
+        self._save_manifest(outdir, manifest)
 
         return run_to_files
+
+    def _remote_file_size(self, url: str) -> int:
+        """
+        Return the size of a remote file (None if unknown), using a HEAD request.
+        """
+        try:
+            response = self.client.head(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Could not check {url}: {e}")
+            return None
+
+        content_length = response.headers.get("content-length")
+        return int(content_length) if content_length else None
+
+    def _resume_download(self, url: str, file_path: str, offset: int) -> bool:
+        """
+        Append the missing part of a partially downloaded file, using an HTTP Range request.
+        """
+        filename = os.path.basename(file_path)
+        print(f"Resuming download of {filename} from byte {offset}...")
+        try:
+            with self.client.stream(
+                "GET", url, headers={"Range": f"bytes={offset}-"}
+            ) as response:
+                response.raise_for_status()
+
+                # A server ignoring the Range header sends the whole file
+                if response.status_code != 206:
+                    offset = 0
+
+                total_size = int(response.headers.get("content-length", 0))
+                with open(file_path, "ab" if offset else "wb") as f, tqdm(
+                    desc=f"Downloading {filename}",
+                    total=offset + total_size,
+                    initial=offset,
+                    unit="B",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                    leave=False,
+                ) as file_bar:
+                    for chunk in response.iter_bytes(chunk_size=1024 * 1024):
+                        f.write(chunk)
+                        file_bar.update(len(chunk))
+        except httpx.HTTPError as e:
+            print(f"Failed to resume download of {url}: {e}")
+            return False
+
+        print(f"Downloaded {filename} to {file_path}")
+        return True
+
+    def _load_manifest(self, outdir: str) -> dict[str, dict]:
+        """
+        Load the manifest of completed downloads (url -> {size}) from 'outdir'.
+        """
+        manifest_path = os.path.join(outdir, DOWNLOAD_MANIFEST_NAME)
+        try:
+            with open(manifest_path) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, outdir: str, manifest: dict[str, dict]):
+        """
+        Save the manifest of completed downloads to 'outdir'.
+        """
+        manifest_path = os.path.join(outdir, DOWNLOAD_MANIFEST_NAME)
+        with open(manifest_path, "w") as json_file:
+            json.dump(manifest, json_file, indent=4)
+
+    def _save_failed_downloads(self, errors, outdir: str):
+        """
+        Save the failed downloads to a JSON file in 'outdir' so they can be retried.
+        """
+        failed_path = os.path.join(outdir, "failed_downloads.json")
+        failed = [
+            {"url": error.url, "error": str(error.exception)} for error in errors
+        ]
+        for entry in failed:
+            print(f"Failed to download {entry['url']}: {entry['error']}")
+
+        with open(failed_path, "w") as json_file:
+            json.dump(failed, json_file, indent=4)
+        print(f"{len(failed)} failed downloads saved to {failed_path}")
@@ -0,0 +1,20 @@
+import httpx
+
+# Client shared by RefSeqRetriver and ENASearcher, so connections (and HTTP/2
+# multiplexing) are reused across requests and Pipeline instances
+_client = None
+
+
+def get_client() -> httpx.Client:
+    """
+    Returns the shared HTTP client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20),
+            timeout=30.0,
+            follow_redirects=True,
+        )
+    return _client
@@ -1,8 +1,40 @@
 import os
-import gzip
+import sys
+import json
+import mmap
+import math
+import itertools
+import functools
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from .refseq_retriver import RefSeqRetriver
-from .ena_searcher import ENASearcher
+import httpx
+import numpy as np
+from tqdm import tqdm
+
+try:
+    # ISA-L accelerated drop-in replacements for the gzip and zlib modules
+    from isal import igzip as _gzip
+    from isal import isal_zlib as _zlib
+except ImportError:
+    import gzip as _gzip
+    import zlib as _zlib
+
+from .cache import DEFAULT_CACHE_DIR
+
+# Size of the blocks read when scanning reference genomes
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+# Buffer size of the underlying file when reading gzipped reference genomes
+READ_BUFFER_SIZE = 256 * 1024
+# Plain reference genomes at least this large are scanned by several processes
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+# Below this size, bytes.count is faster than the NumPy setup overhead
+NUMPY_MIN_SIZE = 4096
+# Magic bytes of a gzip member with extra fields, which every BGZF block starts with
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+# Suffix of the JSON file storing the computed sizes next to a reference genome
+SIZES_SIDECAR_SUFFIX = ".biodbcore.sizes.json"
 
 
 class Pipeline:
@@ -21,6 +53,8 @@ class Pipeline:
         reference_genome: str = None,
         sequence_dir: str = None,
         genome_size_ungapped: int = None,
+        max_conn: int = 5,
+        client: httpx.Client = None,
         **kwargs,
     ):
         self.taxonomy_id = taxonomy_id
@@ -28,26 +62,21 @@ class Pipeline:
         self.mode = mode
         self.reference_genome = reference_genome
         self.sequence_dir = sequence_dir
+        self.genome_size = None
         self.genome_size_ungapped = genome_size_ungapped
+        # Set once the sizes are known for the current reference genome, so they are not recomputed
+        self._sizes_known = False
+        self.max_conn = max_conn
+        self.client = client
+        self._cache_dir = None if kwargs.get("no_cache") else DEFAULT_CACHE_DIR
+        self.refresh_cache = kwargs.get("refresh_cache", False)
 
         os.makedirs(self.outdir, exist_ok=True)
 
-        self.refseq_retriver = RefSeqRetriver(
-            taxonomy_id=self.taxonomy_id, outdir=self.outdir
-        )
-
-        self.ena_searcher = ENASearcher(
-            taxonomy_id=self.taxonomy_id,
-            library_strategy=(
-                [x.lower() for x in kwargs.get("library_strategy", [])]
-                if kwargs.get("library_strategy")
-                else None
-            ),
-            instrument_platform=(
-                [x.lower() for x in kwargs.get("instrument_platform", [])]
-                if kwargs.get("instrument_platform")
-                else None
-            ),
+        # Options for the ENA searcher, which is only created when needed
+        self._ena_options = dict(
+            library_strategy=kwargs.get("library_strategy") or (),
+            instrument_platform=kwargs.get("instrument_platform") or (),
             max_results=kwargs.get("max_results", 10),
             min_coverage=kwargs.get("minimum_coverage"),
             max_coverage=kwargs.get("maximum_coverage"),
@@ -55,6 +84,33 @@ class Pipeline:
             sort=True,
         )
 
+    @functools.cached_property
+    def refseq_retriver(self):
+        """RefSeq retriever, created (and its module imported) on first use."""
+        from .refseq_retriver import RefSeqRetriver
+
+        return RefSeqRetriver(
+            taxonomy_id=self.taxonomy_id,
+            outdir=self.outdir,
+            cache_dir=self._cache_dir,
+            refresh_cache=self.refresh_cache,
+            client=self.client,
+        )
+
+    @functools.cached_property
+    def ena_searcher(self):
+        """ENA searcher, created (and its module imported) on first use."""
+        from .ena_searcher import ENASearcher
+
+        return ENASearcher(
+            taxonomy_id=self.taxonomy_id,
+            max_conn=self.max_conn,
+            cache_dir=self._cache_dir,
+            refresh_cache=self.refresh_cache,
+            client=self.client,
+            **self._ena_options,
+        )
+
     def run(self):
         """Runs the appropriate pipeline based on the selected mode."""
         if self.mode == "refseq":
@@ -68,6 +124,7 @@ class Pipeline:
                 "genome_size_ungapped", self.genome_size_ungapped
             )
             self.reference_genome = refseq_results.get("reference_genome", self.reference_genome)
+            self._sizes_known = self.genome_size_ungapped is not None
             self.run_ena()
         else:
             raise ValueError(f"Unsupported mode: {self.mode}")
@@ -109,7 +166,7 @@ class Pipeline:
 
         print("Searching for sequence data in ENA...")
         # If no genome_size_ungapped is provided, or the user gave us a reference_genome:
-        if not self.genome_size_ungapped and self.reference_genome:
+        if not self.genome_size_ungapped and self.reference_genome and not self._sizes_known:
             self.genome_size, self.genome_size_ungapped = self.calculate_genome_size_from_file(self.reference_genome)
         elif self.genome_size_ungapped:
             print(f"Using provided ungapped genome size: {self.genome_size_ungapped}")
@@ -137,6 +194,46 @@ class Pipeline:
             "all_files_flat": all_downloaded
         }
 
+    def run_many(
+        self, taxonomy_ids: list[int], genome_sizes_ungapped: dict[int, int] = None
+    ) -> dict[int, dict]:
+        """
+        Searches ENA for several taxa with a single query and downloads the FASTQ
+        files of each taxon into its own subdirectory of the output directory.
+
+        Parameters:
+        - taxonomy_ids (list[int]): Taxonomy IDs to search for.
+        - genome_sizes_ungapped (dict[int, int]): Optional taxonomy ID -> ungapped genome size,
+          used for the coverage filters.
+
+        Returns:
+        - dict[int, dict]: taxonomy ID -> results, as returned by run_ena
+        """
+        genome_sizes_ungapped = genome_sizes_ungapped or {}
+
+        print(f"Searching for sequence data in ENA for {len(taxonomy_ids)} taxa...")
+        sequence_data = self.ena_searcher.search_sequence_data_by_taxon(
+            {taxonomy_id: genome_sizes_ungapped.get(taxonomy_id) for taxonomy_id in taxonomy_ids}
+        )
+
+        results = {}
+        for taxonomy_id in taxonomy_ids:
+            sequence_dir = os.path.join(self.outdir, str(taxonomy_id))
+            if not sequence_data[taxonomy_id]:
+                print(f"No sequence data found for taxonomy ID {taxonomy_id}.")
+                results[taxonomy_id] = {"sequence_dir": sequence_dir, "sequence_data": []}
+                continue
+
+            print(f"Downloading FASTQ files for taxonomy ID {taxonomy_id}...")
+            run_accession_to_files = self.ena_searcher.fetch_fastq_files(
+                sequence_data[taxonomy_id], sequence_dir
+            )
+            results[taxonomy_id] = {
+                "sequence_dir": sequence_dir,
+                "run_accession_to_files": run_accession_to_files,
+            }
+
+        return results
 
     def list_sequence_files(self, directory: str, print_files: bool = True) -> list[str]:
         """
@@ -146,38 +243,319 @@ class Pipeline:
             print(f"Directory {directory} does not exist.")
             return []
 
-        file_paths = []
-        for root, dirs, files in os.walk(directory):
-            for name in files:
-                file_paths.append(os.path.join(root, name))
+        file_paths = list(self.iter_sequence_files(directory))
 
         if not file_paths:
             print("No sequence files found in the directory.")
             return []
 
         if print_files:
-            print("\nSequence files found in the directory:")
-            for fp in file_paths:
-                print(f"- {fp}")
+            print(f"\nFound {len(file_paths)} sequence files in the directory.")
+            # Listing every file is opt-in, as it floods the output for large directories.
+            # It goes to stderr in a single write, through tqdm so it does not garble progress bars.
+            if os.environ.get("BIODBCORE_LIST_FILES") == "1":
+                tqdm.write("".join(f"- {fp}\n" for fp in file_paths), file=sys.stderr, end="")
 
         return file_paths
 
 
+    def iter_sequence_files(self, directory: str):
+        """
+        Recursively yields the full paths of all files under 'directory'.
+
+        Uses os.scandir, whose entries carry the file type from the directory
+        listing, so no extra stat call is needed per file. Like os.walk,
+        symbolic links to directories are not followed and files are yielded
+        in top-down order: a directory's files, then each subdirectory in turn.
+        """
+        # Directories still to visit; an explicit stack instead of recursion avoids
+        # passing every path through one nested generator per directory level
+        pending = [directory]
+        while pending:
+            subdirs = []
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif not entry.is_dir():
+                            yield entry.path
+            except OSError:
+                # Unreadable directories are skipped, as os.walk does
+                continue
+            # Pushed in reverse, so the first subdirectory is visited next
+            pending.extend(reversed(subdirs))
+
     def calculate_genome_size_from_file(self, reference_genome: str) -> tuple[int, int]:
-        """Calculates genome size by summing sequence lengths from a genome file (handles both .gz and plain text)."""
-        genome_size = 0
-        genome_size_ungapped = 0
-
-        # Determine if file is gzipped
-        open_func = gzip.open if reference_genome.endswith(".gz") else open
-
-        with open_func(
-            reference_genome, "rt", encoding="utf-8"
-        ) as f:  # 'rt' ensures reading text mode
-            for line in f:
-                if not line.startswith(">"):
-                    sequence = line.strip()
-                    genome_size += len(sequence)
-                    genome_size_ungapped += len(sequence.replace("N", ""))
-
-        return genome_size, genome_size_ungapped
+        """
+        Calculates genome size by summing sequence lengths from a genome file (handles both .gz and plain text).
+        Results are memoized by (path, modification time, size), both in memory and in a sidecar JSON file.
+        """
+        stat = os.stat(reference_genome)
+        return _calculate_genome_size_cached(
+            os.path.abspath(reference_genome), stat.st_mtime_ns, stat.st_size
+        )
+
+
+@functools.lru_cache(maxsize=32)
+def _calculate_genome_size_cached(reference_genome: str, mtime_ns: int, file_size: int) -> tuple[int, int]:
+    """Returns the sizes stored in the sidecar file if it matches the genome file, otherwise scans the file."""
+    sidecar_path = f"{reference_genome}{SIZES_SIDECAR_SUFFIX}"
+
+    try:
+        with open(sidecar_path) as json_file:
+            sizes = json.load(json_file)
+        if sizes["mtime_ns"] == mtime_ns and sizes["size"] == file_size:
+            return sizes["genome_size"], sizes["genome_size_ungapped"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    genome_size, genome_size_ungapped = _calculate_genome_size(reference_genome, file_size)
+
+    try:
+        with open(sidecar_path, "w") as json_file:
+            json.dump(
+                {
+                    "genome_size": genome_size,
+                    "genome_size_ungapped": genome_size_ungapped,
+                    "mtime_ns": mtime_ns,
+                    "size": file_size,
+                },
+                json_file,
+            )
+    except OSError:
+        # The sidecar is only an optimization, e.g. the genome may be in a read-only directory
+        pass
+
+    return genome_size, genome_size_ungapped
+
+
+def _available_cpus() -> int:
+    """Returns the number of CPUs this process may use, respecting affinity and cgroup quotas."""
+    try:
+        # CPU sets from taskset, Slurm or docker --cpuset-cpus
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    try:
+        # CPU quota from docker --cpus or Kubernetes limits (cgroup v2)
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return cpus
+
+
+def _calculate_genome_size(reference_genome: str, file_size: int) -> tuple[int, int]:
+    """Scans a genome file and returns (genome size, ungapped genome size)."""
+    compressed = reference_genome.endswith((".gz", ".bgz"))
+    workers = _available_cpus()
+
+    if workers > 1 and file_size >= PARALLEL_MIN_SIZE:
+        if not compressed:
+            # Plain files can be split and scanned by several processes
+            return _count_fasta_parallel(reference_genome, workers)
+        if _is_bgzf(reference_genome):
+            # BGZF blocks are independent and can be inflated by several threads
+            return _count_bgzf(reference_genome, workers)
+
+    # The compressed stream is read through a large buffer so the decompressor
+    # is fed in big blocks; plain files are read directly in binary mode
+    with open(reference_genome, "rb", buffering=READ_BUFFER_SIZE) as raw, (
+        _gzip.open(raw, "rb") if compressed else nullcontext(raw)
+    ) as f:
+        return _count_fasta_stream(f)
+
+
+def _count_fasta_stream(f) -> tuple[int, int]:
+    """Returns (genome size, ungapped genome size) of a FASTA file opened in binary mode."""
+    genome_size = 0
+    genome_size_ungapped = 0
+    in_header = False
+
+    # Read large binary blocks and tally them with bytes.count instead of
+    # iterating line by line; only blocks containing a header are split.
+    while chunk := f.read(READ_CHUNK_SIZE):
+        size, size_ungapped, in_header = _count_fasta_chunk(chunk, in_header)
+        genome_size += size
+        genome_size_ungapped += size_ungapped
+
+    return genome_size, genome_size_ungapped
+
+
+def _count_fasta_parallel(reference_genome: str, workers: int) -> tuple[int, int]:
+    """
+    Returns (genome size, ungapped genome size) of a plain FASTA file, scanning
+    line-aligned byte ranges of the file in separate processes.
+    """
+    with open(reference_genome, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        file_size = len(mm)
+        bounds = [0]
+        for i in range(1, workers):
+            # Every range starts at the beginning of a line, so no range
+            # starts in the middle of a header
+            newline = mm.find(b"\n", max(file_size * i // workers, bounds[-1]))
+            if newline == -1:
+                break
+            if newline + 1 < file_size:
+                bounds.append(newline + 1)
+        bounds.append(file_size)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        sizes = list(
+            executor.map(
+                _count_fasta_range,
+                [reference_genome] * (len(bounds) - 1),
+                bounds[:-1],
+                bounds[1:],
+            )
+        )
+
+    return sum(size for size, _ in sizes), sum(size for _, size in sizes)
+
+
+def _count_fasta_range(reference_genome: str, start: int, end: int) -> tuple[int, int]:
+    """Returns (size, ungapped size) of the bytes [start, end) of a plain FASTA file."""
+    genome_size = 0
+    genome_size_ungapped = 0
+    in_header = False
+
+    with open(reference_genome, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for offset in range(start, end, READ_CHUNK_SIZE):
+            chunk = mm[offset : min(offset + READ_CHUNK_SIZE, end)]
+            size, size_ungapped, in_header = _count_fasta_chunk(chunk, in_header)
+            genome_size += size
+            genome_size_ungapped += size_ungapped
+
+    return genome_size, genome_size_ungapped
+
+
+def _is_bgzf(reference_genome: str) -> bool:
+    """Checks whether a gzipped file is BGZF, i.e. starts with a block carrying the 'BC' extra subfield."""
+    with open(reference_genome, "rb") as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+
+def _iter_bgzf_blocks(f):
+    """Yields the raw DEFLATE data of every block of a BGZF file opened in binary mode."""
+    while header := f.read(12):
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise ValueError("Invalid BGZF block header.")
+
+        # The total block size is stored in the 'BC' extra subfield
+        extra_length = int.from_bytes(header[10:12], "little")
+        extra = f.read(extra_length)
+        block_size = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            subfield_length = int.from_bytes(extra[pos + 2 : pos + 4], "little")
+            if extra[pos : pos + 2] == b"BC":
+                block_size = int.from_bytes(extra[pos + 4 : pos + 6], "little") + 1
+            pos += 4 + subfield_length
+        if block_size is None:
+            raise ValueError("BGZF block without a block size.")
+
+        # The block ends with the CRC32 and the uncompressed size (4 bytes each)
+        block = f.read(block_size - 12 - extra_length)
+        yield block[:-8]
+
+
+def _inflate_raw(data: bytes) -> bytes:
+    """Decompresses raw DEFLATE data (releases the GIL)."""
+    return _zlib.decompress(data, -15)
+
+
+def _count_bgzf(reference_genome: str, workers: int) -> tuple[int, int]:
+    """
+    Returns (genome size, ungapped genome size) of a BGZF-compressed FASTA file,
+    inflating its blocks in a thread pool.
+    """
+    genome_size = 0
+    genome_size_ungapped = 0
+    in_header = False
+
+    # Blocks are inflated in parallel but counted in order, as a header may span blocks;
+    # only a bounded number of blocks is in flight to keep memory use constant
+    pending = deque()
+    window = workers * 16
+
+    with open(reference_genome, "rb", buffering=READ_BUFFER_SIZE) as f, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        blocks = _iter_bgzf_blocks(f)
+        while True:
+            for block in itertools.islice(blocks, window - len(pending)):
+                pending.append(executor.submit(_inflate_raw, block))
+            if not pending:
+                break
+
+            chunk = pending.popleft().result()
+            size, size_ungapped, in_header = _count_fasta_chunk(chunk, in_header)
+            genome_size += size
+            genome_size_ungapped += size_ungapped
+
+    return genome_size, genome_size_ungapped
+
+
+def _count_sequence_bytes(sequence: bytes, start: int = 0, end: int = None) -> tuple[int, int]:
+    """
+    Returns (size, ungapped size) of the sequence lines in sequence[start:end],
+    ignoring line endings. The range is counted in place, without slicing.
+    """
+    if end is None:
+        end = len(sequence)
+
+    if end - start < NUMPY_MIN_SIZE:
+        size = (end - start) - sequence.count(b"\n", start, end) - sequence.count(b"\r", start, end)
+        return size, size - sequence.count(b"N", start, end) - sequence.count(b"n", start, end)
+
+    # Vectorized comparisons over the raw bytes, without copying them
+    seq = np.frombuffer(sequence, dtype=np.uint8, count=end - start, offset=start)
+    size = seq.size - np.count_nonzero(seq == 0x0A) - np.count_nonzero(seq == 0x0D)
+    gaps = np.count_nonzero(seq == 0x4E) + np.count_nonzero(seq == 0x6E)
+    return int(size), int(size - gaps)
+
+
+def _count_fasta_chunk(chunk: bytes, in_header: bool) -> tuple[int, int, bool]:
+    """
+    Counts sequence bytes in a block of a FASTA file.
+
+    'in_header' tells whether the block starts in the middle of a header line
+    left unfinished by the previous block; the returned flag carries the same
+    information over to the next block.
+    """
+    # Most blocks hold sequence only and are counted in one pass
+    if not in_header and b">" not in chunk:
+        size, size_ungapped = _count_sequence_bytes(chunk)
+        return size, size_ungapped, False
+
+    size = 0
+    size_ungapped = 0
+    pos = 0
+
+    # Jump from header to header and count the sequence between them in bulk,
+    # instead of splitting the block into lines
+    header = 0 if in_header else chunk.find(b">")
+    while header != -1:
+        span_size, span_size_ungapped = _count_sequence_bytes(chunk, pos, header)
+        size += span_size
+        size_ungapped += span_size_ungapped
+
+        newline = chunk.find(b"\n", header)
+        if newline == -1:
+            # The header continues into the next block
+            return size, size_ungapped, True
+        pos = newline + 1
+        header = chunk.find(b">", pos)
+
+    span_size, span_size_ungapped = _count_sequence_bytes(chunk, pos)
+    return size + span_size, size_ungapped + span_size_ungapped, False
@@ -1,9 +1,17 @@
 import os
-import pandas as pd
-import requests
+import httpx
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv
 from tqdm import tqdm
 
+from .cache import is_fresh
 from .constants import REFSEQ_ASSEMBLY_SUMMARY_URL
+from .http_client import get_client
+
+# Parquet metadata key holding the mtime of the summary the table was parsed from
+PARSED_SOURCE_MTIME_KEY = b"biodbcore_source_mtime_ns"
 
 
 class RefSeqRetriver:
@@ -11,22 +19,48 @@ class RefSeqRetriver:
     A class responsible for handling RefSeq genome downloads and metadata.
     """
 
-    def __init__(self, taxonomy_id: int, outdir: str):
+    def __init__(
+        self,
+        taxonomy_id: int,
+        outdir: str,
+        cache_dir: str = None,
+        refresh_cache: bool = False,
+        client: httpx.Client = None,
+    ):
         self.taxonomy_id = taxonomy_id
         self.outdir = outdir
+        self.cache_dir = cache_dir
+        self.refresh_cache = refresh_cache
+        self.client = client or get_client()
         os.makedirs(self.outdir, exist_ok=True)
 
+        # The assembly summary is shared by all taxa, so keep it in the cache when enabled;
+        # a cache directory that cannot be written falls back to 'outdir'
+        summary_dir = self.outdir
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                writable = os.access(self.cache_dir, os.W_OK)
+            except OSError:
+                writable = False
+
+            if writable:
+                summary_dir = self.cache_dir
+            else:
+                print(f"Cache directory {self.cache_dir} is not writable, using {self.outdir}")
+                self.cache_dir = None
+
         self.assembly_summary_path = os.path.join(
-            self.outdir, "assembly_summary_refseq.txt"
+            summary_dir, "assembly_summary_refseq.txt"
         )
         self.parsed_dataframe_path = os.path.join(
-            self.outdir, "assembly_summary_refseq.parquet"
+            summary_dir, "assembly_summary_refseq.parquet"
         )
 
     def get_refseq_genomes(self, taxonomy_id: int, redownload: bool = False):
         """
-        Fetch and download RefSeq genome data for a given taxonomy ID using pandas.
-        Optionally, use a locally saved parsed DataFrame to avoid re-parsing
+        Fetch and download RefSeq genome data for a given taxonomy ID using pyarrow.
+        Optionally, use a locally saved parsed table to avoid re-parsing
         the assembly summary file.
 
         Returns:
@@ -36,28 +70,39 @@ class RefSeqRetriver:
         os.makedirs(self.outdir, exist_ok=True)
 
         # Download the assembly summary if needed
-        if not os.path.exists(self.assembly_summary_path) or redownload:
+        if (
+            redownload
+            or self.refresh_cache
+            or not os.path.exists(self.assembly_summary_path)
+            or (self.cache_dir and not is_fresh(self.assembly_summary_path))
+        ):
             self._download_assembly_summary()
 
-        # Load or parse the assembly summary DataFrame
-        df = self._load_parsed_assembly_summary()
+        # Load or parse the assembly summary table
+        table = self._load_parsed_assembly_summary()
 
         # Filter rows for the given taxonomy ID and assembly levels
-        filtered_df = df[
-            (df["species_taxid"] == taxonomy_id)
-            & (df["assembly_level"].isin(["Complete Genome", "Chromosome"]))
-        ]
+        filtered_table = table.filter(
+            pc.and_(
+                pc.equal(table["species_taxid"], taxonomy_id),
+                pc.is_in(
+                    table["assembly_level"],
+                    value_set=pa.array(["Complete Genome", "Chromosome"]),
+                ),
+            )
+        )
 
-        if filtered_df.empty:
+        if filtered_table.num_rows == 0:
             raise ValueError(f"No RefSeq genomes found for Taxonomy ID {taxonomy_id}.")
 
         print(
-            f"Found {len(filtered_df)} RefSeq genomes. "
+            f"Found {filtered_table.num_rows} RefSeq genomes. "
             f"Checking files for the first genome..."
         )
 
         # Construct the FTP path for the first genome
-        first_genome_path = filtered_df.iloc[0]["ftp_path"]
+        first_genome = filtered_table.slice(0, 1).to_pylist()[0]
+        first_genome_path = first_genome["ftp_path"]
         annotation_name = first_genome_path.split("/")[-1]
         file_name = "genomic.fna.gz"
         full_path = f"{first_genome_path}/{annotation_name}_{file_name}"
@@ -75,8 +120,8 @@ class RefSeqRetriver:
 
         return (
             reference_genome_path,
-            filtered_df.iloc[0]["genome_size"],
-            filtered_df.iloc[0]["genome_size_ungapped"],
+            first_genome["genome_size"],
+            first_genome["genome_size_ungapped"],
         )
 
     def _download_assembly_summary(self):
@@ -84,32 +129,38 @@ class RefSeqRetriver:
         Download the RefSeq assembly summary file.
         """
         print("Downloading the RefSeq assembly summary file...")
-        response = requests.get(REFSEQ_ASSEMBLY_SUMMARY_URL, stream=True)
-        response.raise_for_status()
-
-        total_size = int(response.headers.get("content-length", 0))
-
-        with open(self.assembly_summary_path, "wb") as f, tqdm(
-            desc="Downloading Assembly Summary",
-            total=total_size,
-            unit="B",
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as bar:
-            for chunk in response.iter_content(chunk_size=1024):
-                f.write(chunk)
-                bar.update(len(chunk))
+
+        # Download next to the target and rename, so an interrupted download never leaves
+        # a truncated summary behind; the name is per process, so concurrent runs never
+        # write to the same file
+        tmp_path = f"{self.assembly_summary_path}.{os.getpid()}.part"
+        with self.client.stream("GET", REFSEQ_ASSEMBLY_SUMMARY_URL) as response:
+            response.raise_for_status()
+
+            total_size = int(response.headers.get("content-length", 0))
+            with open(tmp_path, "wb") as f, tqdm(
+                desc="Downloading Assembly Summary",
+                total=total_size,
+                unit="B",
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as bar:
+                for chunk in response.iter_bytes(chunk_size=1024):
+                    f.write(chunk)
+                    bar.update(len(chunk))
+        os.replace(tmp_path, self.assembly_summary_path)
         print(f"Assembly summary file saved to {self.assembly_summary_path}")
 
-    def _load_parsed_assembly_summary(self) -> pd.DataFrame:
+    def _load_parsed_assembly_summary(self) -> pa.Table:
         """
-        Load (or parse and save) the assembly summary DataFrame.
+        Load (or parse and save) the assembly summary table.
         """
-        if os.path.exists(self.parsed_dataframe_path):
-            print(f"Loading parsed DataFrame from {self.parsed_dataframe_path}...")
-            return pd.read_parquet(self.parsed_dataframe_path)
+        source_mtime = str(os.stat(self.assembly_summary_path).st_mtime_ns).encode()
+        if self._is_parsed_table_current(source_mtime):
+            print(f"Loading parsed table from {self.parsed_dataframe_path}...")
+            return pq.read_table(self.parsed_dataframe_path)
         else:
-            print("Loading assembly summary into pandas DataFrame...")
+            print("Loading assembly summary into Arrow table...")
             columns = [
                 "assembly_accession",
                 "bioproject",
@@ -150,35 +201,66 @@ class RefSeqRetriver:
                 "non_coding_gene_count",
                 "pubmed_id",
             ]
-            df = pd.read_csv(
+            # The CSV reader has no comment support, so skip the leading '#' lines
+            skip_rows = 0
+            with open(self.assembly_summary_path, "rb") as f:
+                for line in f:
+                    if not line.startswith(b"#"):
+                        break
+                    skip_rows += 1
+
+            # Read the columns as strings, except the numeric ones used for filtering;
+            # inferring types per block fails on columns mixing numbers and "na"
+            column_types = {column: pa.string() for column in columns}
+            column_types.update(
+                species_taxid=pa.int64(),
+                genome_size=pa.int64(),
+                genome_size_ungapped=pa.int64(),
+            )
+
+            table = csv.read_csv(
                 self.assembly_summary_path,
-                sep="\t",
-                comment="#",
-                header=None,
-                names=columns,
-                low_memory=False,
+                read_options=csv.ReadOptions(column_names=columns, skip_rows=skip_rows),
+                parse_options=csv.ParseOptions(delimiter="\t", quote_char=False),
+                convert_options=csv.ConvertOptions(column_types=column_types),
             )
-            print(f"Saving parsed DataFrame to {self.parsed_dataframe_path}...")
-            df.to_parquet(self.parsed_dataframe_path, index=False)
-            return df
+            print(f"Saving parsed table to {self.parsed_dataframe_path}...")
+            table = table.replace_schema_metadata({PARSED_SOURCE_MTIME_KEY: source_mtime})
+
+            # Write to a per-process temporary file and rename, so concurrent runs never
+            # read a partially written table
+            tmp_path = f"{self.parsed_dataframe_path}.{os.getpid()}.tmp"
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, self.parsed_dataframe_path)
+            return table
+
+    def _is_parsed_table_current(self, source_mtime: bytes) -> bool:
+        """
+        Check whether the saved table was parsed from the summary with mtime 'source_mtime',
+        so a redownloaded summary is parsed again.
+        """
+        if not os.path.exists(self.parsed_dataframe_path):
+            return False
+        metadata = pq.read_schema(self.parsed_dataframe_path).metadata or {}
+        return metadata.get(PARSED_SOURCE_MTIME_KEY) == source_mtime
 
     def _download_reference_genome(self, url: str, output_path: str):
         """
         Download a single genome file from the given URL to output_path.
         """
         print(f"Downloading genome from {url}...")
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        total_size = int(response.headers.get("content-length", 0))
-        with open(output_path, "wb") as f, tqdm(
-            desc="Downloading Genome File",
-            total=total_size,
-            unit="B",
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as bar:
-            for chunk in response.iter_content(chunk_size=1024):
-                f.write(chunk)
-                bar.update(len(chunk))
+        with self.client.stream("GET", url) as response:
+            response.raise_for_status()
+
+            total_size = int(response.headers.get("content-length", 0))
+            with open(output_path, "wb") as f, tqdm(
+                desc="Downloading Genome File",
+                total=total_size,
+                unit="B",
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as bar:
+                for chunk in response.iter_bytes(chunk_size=1024):
+                    f.write(chunk)
+                    bar.update(len(chunk))
         print(f"Genome downloaded and saved to {output_path}")